@@ -6,23 +6,45 @@ This script parses markdown files and extracts code blocks marked with ```zig,
 creating a mapping that can be used for validation or extraction.
 """
 
+import os
 import re
 import sys
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Dict
 import json
 
-def extract_code_blocks(markdown_content: str, file_path: str) -> List[Dict]:
-    """Extract all ```zig code blocks from markdown content."""
-    code_blocks = []
-    lines = markdown_content.split('\n')
-
+class Block(NamedTuple):
+    """A ```zig code block and its location in the source markdown."""
+    index: int
+    start_line: int
+    end_line: int
+    code: str
+    file: str
+    lines: int
+    chars: int
+
+def block_to_dict(block: Block, with_code: bool = True) -> Dict:
+    """Convert a Block to a JSON-serializable dict, optionally without its source."""
+    data = block._asdict()
+    if not with_code:
+        del data['code']
+    return data
+
+def read_markdown(md_file: Path) -> str:
+    """Read a UTF-8 markdown file with universal newlines, as read_text() does."""
+    content = md_file.read_bytes().decode('utf-8')
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+def extract_code_blocks(markdown_content: str, file_path: str) -> Iterator[Block]:
+    """Yield each ```zig code block in markdown content as its fence closes."""
     in_code_block = False
     code_lines = []
     start_line = 0
     block_index = 0
 
-    for i, line in enumerate(lines, 1):
+    for i, line in enumerate(markdown_content.split('\n'), 1):
         if line.strip().startswith('```zig'):
             in_code_block = True
             code_lines = []
@@ -34,20 +56,18 @@ def extract_code_blocks(markdown_content: str, file_path: str) -> List[Dict]:
             # Skip empty blocks
             if code.strip():
                 block_index += 1
-                code_blocks.append({
-                    'index': block_index,
-                    'start_line': start_line,
-                    'end_line': i,
-                    'code': code,
-                    'file': file_path,
-                    'lines': len(code_lines),
-                    'chars': len(code)
-                })
+                yield Block(
+                    index=block_index,
+                    start_line=start_line,
+                    end_line=i,
+                    code=code,
+                    file=file_path,
+                    lines=len(code_lines),
+                    chars=len(code)
+                )
         elif in_code_block:
             code_lines.append(line)
 
-    return code_blocks
-
 def is_runnable_example(code: str) -> bool:
     """Determine if a code block is a complete, runnable example."""
     # Check for main function or test
@@ -58,69 +78,81 @@ def is_runnable_example(code: str) -> bool:
     has_imports = '@import' in code
 
     # Likely a snippet if it's just a few lines without structure
-    is_snippet = len(code.split('\n')) < 10 and not (has_main or has_test)
+    is_snippet = code.count('\n') + 1 < 10 and not (has_main or has_test)
 
     return (has_main or has_test) and has_imports and not is_snippet
 
-def categorize_blocks(blocks: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+def categorize_blocks(blocks: Iterable[Block]) -> Tuple[List[Block], List[Block]]:
     """Categorize blocks as runnable examples or inline snippets."""
     runnable = []
     snippets = []
 
     for block in blocks:
-        if is_runnable_example(block['code']):
+        if is_runnable_example(block.code):
             runnable.append(block)
         else:
             snippets.append(block)
 
     return runnable, snippets
 
-def analyze_chapter(chapter_path: Path) -> Dict:
-    """Analyze a chapter's markdown file and extract code block info."""
-    content_file = chapter_path / 'content.md'
+def analyze_markdown(md_file: Path, chapter_name: str, with_code: bool = False) -> Optional[Dict]:
+    """Analyze one markdown file and extract code block info.
 
-    if not content_file.exists():
+    Block source text is dropped from the result unless with_code is set.
+    Returns None if the file does not exist.
+    """
+    try:
+        content = read_markdown(md_file)
+    except FileNotFoundError:
         return None
-
-    content = content_file.read_text()
-    blocks = extract_code_blocks(content, str(content_file))
-    runnable, snippets = categorize_blocks(blocks)
+    runnable, snippets = categorize_blocks(extract_code_blocks(content, str(md_file)))
 
     return {
-        'chapter': chapter_path.name,
-        'content_file': str(content_file),
-        'total_blocks': len(blocks),
+        'chapter': chapter_name,
+        'content_file': str(md_file),
+        'total_blocks': len(runnable) + len(snippets),
         'runnable_blocks': len(runnable),
         'snippet_blocks': len(snippets),
-        'runnable': runnable,
-        'snippets': snippets
+        'runnable': [block_to_dict(b, with_code) for b in runnable],
+        'snippets': [block_to_dict(b, with_code) for b in snippets]
     }
 
+def analyze_chapter(chapter_path: Path, with_code: bool = False) -> Optional[Dict]:
+    """Analyze a chapter's markdown file and extract code block info."""
+    return analyze_markdown(chapter_path / 'content.md', chapter_path.name, with_code)
+
+def dump_json(data) -> bytes:
+    """Serialize data as indented JSON."""
+    return json.dumps(data, indent=2).encode('utf-8')
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: extract_code_blocks.py <sections_directory>")
+    args = [arg for arg in sys.argv[1:] if arg != '--with-code']
+    with_code = len(args) < len(sys.argv) - 1
+
+    if not args:
+        print("Usage: extract_code_blocks.py [--with-code] <sections_directory>")
         print("   or: extract_code_blocks.py <markdown_file>")
+        print("\n  --with-code  include block source in code_blocks_analysis.json")
         sys.exit(1)
 
-    path = Path(sys.argv[1])
+    path = Path(args[0])
 
     if path.is_file():
         # Analyze single file
-        content = path.read_text()
-        blocks = extract_code_blocks(content, str(path))
-        runnable, snippets = categorize_blocks(blocks)
+        content = read_markdown(path)
+        runnable, snippets = categorize_blocks(extract_code_blocks(content, str(path)))
 
         print(f"\n=== {path.name} ===")
-        print(f"Total blocks: {len(blocks)}")
+        print(f"Total blocks: {len(runnable) + len(snippets)}")
         print(f"Runnable examples: {len(runnable)}")
         print(f"Inline snippets: {len(snippets)}")
 
         if runnable:
             print(f"\n--- Runnable Examples ({len(runnable)}) ---")
             for block in runnable:
-                print(f"  Block #{block['index']} (lines {block['start_line']}-{block['end_line']}, {block['lines']} lines)")
+                print(f"  Block #{block.index} (lines {block.start_line}-{block.end_line}, {block.lines} lines)")
                 # Show first line of code
-                first_line = block['code'].split('\n')[0][:60]
+                first_line = block.code.split('\n')[0][:60]
                 print(f"    {first_line}...")
 
     elif path.is_dir():
@@ -128,10 +160,13 @@ def main():
         # Supports both old structure (sections/*/content.md) and new structure (src/*.md)
 
         # Check if this is the old sections/ structure with subdirectories
-        subdirs = sorted([d for d in path.iterdir() if d.is_dir()])
-        if subdirs and any((d / 'content.md').exists() for d in subdirs):
-            # Old structure: sections/01_chapter/content.md
-            markdown_files = [(d / 'content.md', d.name) for d in subdirs if (d / 'content.md').exists()]
+        with os.scandir(path) as it:
+            subdirs = sorted((Path(e.path) for e in it if e.is_dir(follow_symlinks=False)),
+                             key=lambda d: d.name)
+        if any((d / 'content.md').exists() for d in subdirs):
+            # Old structure: sections/01_chapter/content.md. Subdirectories
+            # without one are skipped when analyze_markdown fails to open it.
+            markdown_files = [(d / 'content.md', d.name) for d in subdirs]
         else:
             # New structure: src/ch01_chapter.md
             markdown_files = [(f, f.stem) for f in sorted(path.glob('ch*.md'))]
@@ -142,43 +177,42 @@ def main():
             'snippets': 0
         }
 
-        results = []
-
-        for md_file, chapter_name in markdown_files:
-            content = md_file.read_text()
-            blocks = extract_code_blocks(content, str(md_file))
-            runnable, snippets = categorize_blocks(blocks)
-
-            result = {
-                'chapter': chapter_name,
-                'content_file': str(md_file),
-                'total_blocks': len(blocks),
-                'runnable_blocks': len(runnable),
-                'snippet_blocks': len(snippets),
-                'runnable': runnable,
-                'snippets': snippets
-            }
-
-            results.append(result)
-            total_stats['total_blocks'] += result['total_blocks']
-            total_stats['runnable'] += result['runnable_blocks']
-            total_stats['snippets'] += result['snippet_blocks']
-
-        # Print summary
+        # Print each chapter's summary row and JSON entry as soon as it is
+        # analyzed, so only one chapter's results are held at a time.
+        output_file = Path('code_blocks_analysis.json')
         print("\n=== Code Block Analysis ===\n")
         print(f"{'Chapter':<30} {'Total':<8} {'Runnable':<10} {'Snippets':<10}")
         print("-" * 60)
 
-        for result in results:
-            print(f"{result['chapter']:<30} {result['total_blocks']:<8} {result['runnable_blocks']:<10} {result['snippet_blocks']:<10}")
+        # Stream into a sibling temp file and move it over the target only once
+        # the array is complete, so a failing chapter leaves the previous
+        # results in place instead of a truncated file.
+        tmp_file = output_file.with_name(f'{output_file.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(b'[')
+                separator = b'\n  '
+                for md_file, chapter_name in markdown_files:
+                    result = analyze_markdown(md_file, chapter_name, with_code)
+                    if result is None:
+                        continue
+                    f.write(separator)
+                    f.write(dump_json(result).replace(b'\n', b'\n  '))
+                    separator = b',\n  '
+
+                    print(f"{result['chapter']:<30} {result['total_blocks']:<8} {result['runnable_blocks']:<10} {result['snippet_blocks']:<10}")
+                    total_stats['total_blocks'] += result['total_blocks']
+                    total_stats['runnable'] += result['runnable_blocks']
+                    total_stats['snippets'] += result['snippet_blocks']
+                f.write(b']' if separator == b'\n  ' else b'\n]')
+            os.replace(tmp_file, output_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
 
         print("-" * 60)
         print(f"{'TOTAL':<30} {total_stats['total_blocks']:<8} {total_stats['runnable']:<10} {total_stats['snippets']:<10}")
 
-        # Save detailed results to JSON
-        output_file = Path('code_blocks_analysis.json')
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
         print(f"\nDetailed results saved to: {output_file}")
 
     else: